@@ -0,0 +1,158 @@
+import heapq
+import math
+import numpy as np
+from numba import njit, prange
+
+EARTH_RADIUS = 6371000  # Radius of earth in meters
+
+@njit('f8(f8, f8, f8, f8)', fastmath=True, cache=True)
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great circle distance in meters between two points
+    on the earth (specified in decimal degrees)
+    """
+    # Convert decimal degrees to radians
+    lat1 = math.radians(lat1)
+    lon1 = math.radians(lon1)
+    lat2 = math.radians(lat2)
+    lon2 = math.radians(lon2)
+
+    # Haversine formula
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+    return c * EARTH_RADIUS
+
+@njit(parallel=True, cache=True)
+def haversine_bulk(lats, lons, clat, clon, out):
+    """
+    Vectorized haversine: distance in meters from every (lats[i], lons[i])
+    to the center (clat, clon), written into out and returned
+    """
+    clat_rad = math.radians(clat)
+    clon_rad = math.radians(clon)
+    cos_clat = math.cos(clat_rad)
+
+    for i in prange(lats.shape[0]):
+        lat = math.radians(lats[i])
+        dlon = clon_rad - math.radians(lons[i])
+        dlat = clat_rad - lat
+        a = math.sin(dlat/2)**2 + math.cos(lat) * cos_clat * math.sin(dlon/2)**2
+        out[i] = 2 * math.asin(math.sqrt(a)) * EARTH_RADIUS
+
+    return out
+
+@njit(parallel=True, fastmath=True, cache=True)
+def haversine_within_bulk(lats, lons, clat, clon, a_thresh, out):
+    """
+    Vectorized radius check: whether every (lats[i], lons[i]) has a haversine
+    a-term of at most a_thresh from the center (clat, clon), written into out and returned
+    """
+    clat_rad = math.radians(clat)
+    clon_rad = math.radians(clon)
+    cos_clat = math.cos(clat_rad)
+
+    for i in prange(lats.shape[0]):
+        lat = math.radians(lats[i])
+        dlon = clon_rad - math.radians(lons[i])
+        dlat = clat_rad - lat
+        a = math.sin(dlat/2)**2 + math.cos(lat) * cos_clat * math.sin(dlon/2)**2
+        out[i] = a <= a_thresh
+
+    return out
+
+@njit(nogil=True, cache=True)
+def astar_csr(start_idx, exit_mask, h_precomputed, indptr, indices, weights, edge_water, node_water):
+    """
+    A* search over a CSR road network, from start_idx to the first node in exit_mask
+    h_precomputed holds the heuristic for every node; water nodes are never entered and
+    water-crossing edges cost 10000x their length. Returns the path as node indices
+    (empty if no exit can be reached)
+    """
+    n = indptr.shape[0] - 1
+    g_score = np.full(n, np.inf)
+    came_from = np.full(n, -1, dtype=np.int64)
+    
+    g_score[start_idx] = 0.0
+    open_set = [(h_precomputed[start_idx], np.int64(start_idx))]
+    
+    while len(open_set) > 0:
+        f, current = heapq.heappop(open_set)
+        
+        # Skip stale entries left behind when a shorter path was found
+        if f > g_score[current] + h_precomputed[current]:
+            continue
+        
+        # Check if we've reached an exit node, then reconstruct the path
+        if exit_mask[current]:
+            length = 1
+            node = current
+            while came_from[node] != -1:
+                node = came_from[node]
+                length += 1
+            path = np.empty(length, dtype=np.int64)
+            node = current
+            for i in range(length - 1, -1, -1):
+                path[i] = node
+                node = came_from[node]
+            return path
+        
+        for j in range(indptr[current], indptr[current + 1]):
+            neighbor = np.int64(indices[j])
+            if node_water[neighbor]:
+                continue
+            
+            water_penalty = 10000.0 if edge_water[j] else 1.0
+            tentative_g_score = g_score[current] + weights[j] * water_penalty
+            
+            if tentative_g_score < g_score[neighbor]:
+                came_from[neighbor] = current
+                g_score[neighbor] = tentative_g_score
+                heapq.heappush(open_set, (tentative_g_score + h_precomputed[neighbor], neighbor))
+    
+    return np.empty(0, dtype=np.int64)
+
+@njit(nogil=True, cache=True)
+def dijkstra_to_exits_csr(exit_indices, indptr, indices, weights, edge_water, node_water):
+    """
+    Multi-source Dijkstra outward from every exit node over a reversed CSR road network
+    (indices holds each edge's source node). Returns next_hop, where next_hop[i] is the
+    node to move to from i on its shortest route to an exit: i itself at an exit and
+    -1 where no exit can be reached
+    """
+    n = indptr.shape[0] - 1
+    distance = np.full(n, np.inf)
+    next_hop = np.full(n, -1, dtype=np.int64)
+    
+    # Seed the heap with every exit, as if joined to a virtual super-source
+    open_set = [(0.0, np.int64(exit_indices[0]))]
+    for k in range(exit_indices.shape[0]):
+        exit_idx = exit_indices[k]
+        distance[exit_idx] = 0.0
+        next_hop[exit_idx] = exit_idx
+        if k > 0:
+            heapq.heappush(open_set, (0.0, np.int64(exit_idx)))
+    
+    while len(open_set) > 0:
+        current_distance, current = heapq.heappop(open_set)
+        
+        # Skip stale entries left behind when a shorter route was found
+        if current_distance > distance[current]:
+            continue
+        
+        # Each entry is an edge predecessor -> current
+        for j in range(indptr[current], indptr[current + 1]):
+            predecessor = np.int64(indices[j])
+            if node_water[predecessor]:
+                continue
+            
+            water_penalty = 10000.0 if edge_water[j] else 1.0
+            tentative_distance = current_distance + weights[j] * water_penalty
+            
+            if tentative_distance < distance[predecessor]:
+                distance[predecessor] = tentative_distance
+                next_hop[predecessor] = current
+                heapq.heappush(open_set, (tentative_distance, predecessor))
+    
+    return next_hop
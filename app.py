@@ -6,9 +6,9 @@ import networkx as nx
 import numpy as np
 import matplotlib.pyplot as plt
 import math
-from evacuation_algorithm import a_star_evacuation
+from evacuation_algorithm import compute_evacuation_tree, get_evacuation_route
 from map_utils import create_base_map, add_disaster_marker, add_person_markers, add_evacuation_paths
-from data_processing import get_nearest_node, check_if_in_radius, filter_road_network
+from data_processing import get_nearest_nodes, check_if_in_radius, load_road_network
 
 # Set page configuration
 st.set_page_config(
@@ -17,6 +17,51 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_cached_road_network(center_location, dist, network_type='drive'):
+    """Road network shared across reruns and sessions; backed by the on-disk cache"""
+    return load_road_network(center_location, dist, network_type)
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def get_evacuation_tree(network_key, disaster_node, disaster_radius):
+    """Shortest-path tree to the exits of a disaster zone, built once per network and zone"""
+    return compute_evacuation_tree(load_cached_road_network(*network_key), disaster_node, disaster_radius)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def compute_all_routes(network_key, disaster_node, disaster_radius, persons):
+    """
+    Evacuation routes for every person in the disaster zone, keyed by person
+    network_key is the (center, dist, network_type) the road network was loaded with,
+    a hashable stand-in for the graph itself, so reruns with unchanged inputs skip routing
+    """
+    G = load_cached_road_network(*network_key)
+    
+    people_in_danger = [
+        person for person in persons
+        if check_if_in_radius(person, disaster_node, disaster_radius)
+    ]
+    if not people_in_danger:
+        return {}
+    
+    # One search from the exits covers every person
+    evacuation_tree = get_evacuation_tree(network_key, disaster_node, disaster_radius)
+    
+    # Find nearest nodes in the road network for everyone at once
+    person_nodes = get_nearest_nodes(
+        G,
+        [person_lat for person_lat, _ in people_in_danger],
+        [person_lon for _, person_lon in people_in_danger]
+    )
+    
+    routes = {}
+    for person, person_node in zip(people_in_danger, person_nodes):
+        # Find evacuation route
+        route = get_evacuation_route(G, evacuation_tree, person_node, disaster_node, disaster_radius)
+        if route:
+            routes[person] = route
+    
+    return routes
+
 # Initialize session state variables if not already done
 if 'disaster_node' not in st.session_state:
     st.session_state.disaster_node = None
@@ -32,6 +77,8 @@ if 'evacuation_routes' not in st.session_state:
     st.session_state.evacuation_routes = {}
 if 'map_initialized' not in st.session_state:
     st.session_state.map_initialized = False
+if 'road_network_key' not in st.session_state:
+    st.session_state.road_network_key = None
 
 # Title and introduction
 st.title("Smart Evacuation Router")
@@ -97,18 +144,17 @@ with st.sidebar:
 if not st.session_state.map_initialized or st.session_state.road_network is None:
     try:
         with st.spinner("Loading road network data... This may take a minute."):
-            # Download the street network for the selected area
-            G = ox.graph_from_point(
-                center_point=st.session_state.center_location, 
-                dist=max(5000, st.session_state.disaster_radius * 1.5),
-                network_type='drive'
+            # Download the street network for the selected area (or reuse a cached copy)
+            network_key = (
+                tuple(st.session_state.center_location),
+                max(5000, st.session_state.disaster_radius * 1.5),
+                'drive'
             )
-            
-            # Filter the network to remove roads through water if that data is available
-            G = filter_road_network(G)
+            G = load_cached_road_network(*network_key)
             
             # Store the road network in session state
             st.session_state.road_network = G
+            st.session_state.road_network_key = network_key
             st.session_state.map_initialized = True
     except Exception as e:
         st.error(f"Error loading road network: {e}")
@@ -137,30 +183,15 @@ with col1:
         
         # Recalculate routes for existing people in danger zone
         if st.session_state.person_nodes:
-            for person_lat, person_lon in st.session_state.person_nodes:
-                in_radius = check_if_in_radius(
-                    (person_lat, person_lon), 
-                    st.session_state.disaster_node, 
-                    st.session_state.disaster_radius
+            try:
+                st.session_state.evacuation_routes = compute_all_routes(
+                    st.session_state.road_network_key,
+                    st.session_state.disaster_node,
+                    st.session_state.disaster_radius,
+                    tuple(st.session_state.person_nodes)
                 )
-                
-                if in_radius:
-                    try:
-                        # Find nearest nodes in the road network
-                        person_node = get_nearest_node(st.session_state.road_network, person_lat, person_lon)
-                        
-                        # Find evacuation route
-                        route = a_star_evacuation(
-                            st.session_state.road_network,
-                            person_node,
-                            st.session_state.disaster_node,
-                            st.session_state.disaster_radius
-                        )
-                        
-                        if route:
-                            st.session_state.evacuation_routes[(person_lat, person_lon)] = route
-                    except Exception as e:
-                        st.error(f"Error calculating route: {e}")
+            except Exception as e:
+                st.error(f"Error calculating route: {e}")
         
         st.success(f"Disaster zone placed at [{disaster_lat:.6f}, {disaster_lon:.6f}]")
         st.rerun()
@@ -186,16 +217,13 @@ with col2:
                 if in_radius:
                     with st.spinner("Calculating evacuation route..."):
                         try:
-                            # Find nearest nodes in the road network
-                            person_node = get_nearest_node(st.session_state.road_network, person_lat, person_lon)
-                            
                             # Find evacuation route
-                            route = a_star_evacuation(
-                                st.session_state.road_network,
-                                person_node,
+                            route = compute_all_routes(
+                                st.session_state.road_network_key,
                                 st.session_state.disaster_node,
-                                st.session_state.disaster_radius
-                            )
+                                st.session_state.disaster_radius,
+                                (new_person,)
+                            ).get(new_person)
                             
                             if route:
                                 st.session_state.evacuation_routes[(person_lat, person_lon)] = route
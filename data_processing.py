@@ -1,45 +1,62 @@
 import networkx as nx
 import numpy as np
 import math
+import os
+import pickle
+import hashlib
 import osmnx as ox
+from scipy import sparse
+from scipy.spatial import cKDTree
+from _geo_numba import EARTH_RADIUS, haversine as haversine_distance
+
+# Directory holding prepared road networks between runs
+NETWORK_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'network_cache')
+
+# Bump whenever the annotations or derived arrays stored with a cached network change,
+# so entries pickled by older code are no longer picked up
+CACHE_FORMAT_VERSION = 2
+
+# Everything _ensure_node_arrays and _ensure_node_kdtree store on G.graph
+NODE_ARRAY_KEYS = (
+    '_node_ids', '_node_index', '_xy', '_node_water', '_is_major', '_adjacency',
+    '_csr_indptr', '_csr_indices', '_csr_lengths', '_csr_water',
+    '_rcsr_indptr', '_rcsr_indices', '_rcsr_lengths', '_rcsr_water'
+)
+NODE_KDTREE_KEYS = ('_kdtree', '_kdtree_nodes', '_kdtree_lat0')
+
+# OSM tag values that mark a node as water
+WATER_NATURAL = ['water', 'coastline', 'wetland', 'bay', 'beach', 'marsh']
+WATER_WATERWAY = ['river', 'canal', 'stream', 'ditch', 'dock', 'riverbank']
+WATER_LANDUSE = ['reservoir', 'basin', 'water']
+
+# Road types that make a node a preferred exit point
+MAJOR_ROAD_TYPES = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary']
 
 def get_nearest_node(G, lat, lon):
     """Find the nearest node in the graph to the given coordinates"""
-    try:
-        # Use OSMnx's built-in get_nearest_node function
-        nearest_node = ox.distance.nearest_nodes(G, lon, lat)
-        return nearest_node
-    except Exception as e:
-        # Fallback method if the above fails
-        min_distance = float('inf')
-        nearest_node = None
-        
-        for node_id, node_data in G.nodes(data=True):
-            if 'x' in node_data and 'y' in node_data:
-                node_lon, node_lat = node_data['x'], node_data['y']
-                distance = haversine_distance(lat, lon, node_lat, node_lon)
-                
-                if distance < min_distance:
-                    min_distance = distance
-                    nearest_node = node_id
-        
-        return nearest_node
+    return get_nearest_nodes(G, [lat], [lon])[0]
+
+def get_nearest_nodes(G, lats, lons):
+    """Find the nearest graph node for each of many coordinates with a single batched query"""
+    # KD-tree over projected node coordinates, built once per road network
+    _ensure_node_kdtree(G)
+    if G.graph['_kdtree'].n == 0:
+        return [None] * len(lats)
+    
+    points = project_to_plane(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float), G.graph['_kdtree_lat0'])
+    _, nearest = G.graph['_kdtree'].query(points, k=1)
+    return G.graph['_node_ids'][G.graph['_kdtree_nodes'][nearest]].tolist()
 
-def haversine_distance(lat1, lon1, lat2, lon2):
+def project_to_plane(lats, lons, lat0):
     """
-    Calculate the great circle distance between two points 
-    on the earth (specified in decimal degrees)
+    Project coordinates (decimal degrees) to local tangent-plane meters around latitude lat0
+    Equirectangular approximation, accurate over city-scale extents
+    Returns an (N, 2) array of (x, y)
     """
-    # Convert decimal degrees to radians
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371000  # Radius of earth in meters
-    return c * r
+    return np.column_stack([
+        EARTH_RADIUS * math.cos(math.radians(lat0)) * np.radians(lons),
+        EARTH_RADIUS * np.radians(lats)
+    ])
 
 def check_if_in_radius(point, center, radius):
     """Check if a point is within the given radius from center"""
@@ -51,24 +68,22 @@ def check_if_in_radius(point, center, radius):
     
     return distance <= radius
 
-def filter_road_network(G):
+def annotate_water(G):
     """
-    Filter the road network to mark water bodies and other obstacles
+    Mark water bodies and other obstacles on the road network, in place
     This is a simplified version as detailed water body data might not be available
+    Also records each node's road class as its 'highway_class' attribute
     """
-    # Make a copy of the graph to avoid modifying the original
-    G_filtered = G.copy()
-    
     # Mark water-adjacent nodes based on OSM tags if available
-    for node, data in G_filtered.nodes(data=True):
+    for node, data in G.nodes(data=True):
         # Check for water-related tags
         is_water = False
         
         # Check for explicit water tags
-        if 'natural' in data and data['natural'] in ['water', 'coastline', 'wetland', 'bay', 'beach', 'marsh']:
+        if 'natural' in data and data['natural'] in WATER_NATURAL:
             is_water = True
         
-        if 'waterway' in data and data['waterway'] in ['river', 'canal', 'stream', 'ditch', 'dock', 'riverbank']:
+        if 'waterway' in data and data['waterway'] in WATER_WATERWAY:
             is_water = True
         
         # Additional water-related tags
@@ -76,19 +91,20 @@ def filter_road_network(G):
             is_water = True
             
         # Check for landuse tags related to water
-        if 'landuse' in data and data['landuse'] in ['reservoir', 'basin', 'water']:
+        if 'landuse' in data and data['landuse'] in WATER_LANDUSE:
             is_water = True
             
         data['is_water'] = is_water
+        data['highway_class'] = None
     
     # Mark water-crossing edges based on node attributes and edge tags
-    for u, v, data in G_filtered.edges(data=True):
+    for u, v, data in G.edges(data=True):
         # Check for bridge tags (bridges are OK to cross water)
         is_bridge = 'bridge' in data and data['bridge'] not in ['no', 'false', '0']
         
         # Check if either endpoint is in water
-        node_u_in_water = G_filtered.nodes[u].get('is_water', False)
-        node_v_in_water = G_filtered.nodes[v].get('is_water', False)
+        node_u_in_water = G.nodes[u].get('is_water', False)
+        node_v_in_water = G.nodes[v].get('is_water', False)
         
         # Mark edge as water crossing if one or both nodes are in water and it's not a bridge
         if (node_u_in_water or node_v_in_water) and not is_bridge:
@@ -100,8 +116,50 @@ def filter_road_network(G):
         if any(tag in data for tag in ['waterway', 'water', 'natural']):
             if not is_bridge:  # Still allow bridges
                 data['is_water'] = True
+        
+        # Road class of a node: highway tag of its first tagged outgoing edge
+        if G.nodes[u]['highway_class'] is None and data.get('highway') is not None:
+            G.nodes[u]['highway_class'] = data['highway']
     
-    return G_filtered
+    return G
+
+def road_network_cache_key(center_location, dist, network_type):
+    """Stable identifier for a road network download, tied to the cache format"""
+    return hashlib.sha1(
+        repr((CACHE_FORMAT_VERSION, tuple(center_location), dist, network_type)).encode()
+    ).hexdigest()
+
+def load_road_network(center_location, dist, network_type='drive'):
+    """
+    Download the street network around center_location and prepare it for routing
+    The annotated graph, together with its precomputed node arrays, CSR adjacency and KD-tree,
+    is pickled to NETWORK_CACHE_DIR so later runs skip the download entirely
+    """
+    cache_path = os.path.join(
+        NETWORK_CACHE_DIR, road_network_cache_key(center_location, dist, network_type) + '.pkl'
+    )
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    
+    # Download the street network for the selected area
+    G = ox.graph_from_point(
+        center_point=tuple(center_location),
+        dist=dist,
+        network_type=network_type
+    )
+    
+    # Mark roads through water if that data is available
+    annotate_water(G)
+    _ensure_node_kdtree(G)
+    
+    # Write to a temporary file first so an interrupted run can't leave a partial cache entry
+    os.makedirs(NETWORK_CACHE_DIR, exist_ok=True)
+    with open(cache_path + '.tmp', 'wb') as f:
+        pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_path + '.tmp', cache_path)
+    
+    return G
 
 def find_exit_nodes(G, disaster_node, disaster_radius):
     """Find nodes that are just outside the disaster radius"""
@@ -127,3 +185,89 @@ def find_exit_nodes(G, disaster_node, disaster_radius):
     exit_nodes = list(set(exit_nodes))
     
     return exit_nodes
+
+def _ensure_node_arrays(G):
+    """
+    Build flat per-node arrays for vectorized lookups and cache them on G.graph
+    This runs once per road network; later calls are free
+    """
+    if all(key in G.graph for key in NODE_ARRAY_KEYS):
+        return
+    
+    node_ids = list(G.nodes())
+    node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+    
+    # Node coordinates as an (N, 2) array of (x, y); NaN where missing
+    xy = np.full((len(node_ids), 2), np.nan)
+    is_water = np.zeros(len(node_ids), dtype=bool)
+    is_major = np.zeros(len(node_ids), dtype=bool)
+    for i, (node_id, node_data) in enumerate(G.nodes(data=True)):
+        if 'x' in node_data and 'y' in node_data:
+            xy[i] = node_data['x'], node_data['y']
+        is_water[i] = node_data.get('is_water', False)
+        is_major[i] = node_data.get('highway_class') in MAJOR_ROAD_TYPES
+    
+    # Edge list over node indices, with road length and water flag per edge
+    src, dst, lengths, edge_water = [], [], [], []
+    for u, v, edge_data in G.edges(data=True):
+        src.append(node_index[u])
+        dst.append(node_index[v])
+        lengths.append(edge_data.get('length', 100))  # Default length if not available
+        edge_water.append(edge_data.get('is_water', False))
+        if not G.is_directed():
+            src.append(node_index[v])
+            dst.append(node_index[u])
+            lengths.append(lengths[-1])
+            edge_water.append(edge_water[-1])
+    src = np.array(src, dtype=np.int32)
+    dst = np.array(dst, dtype=np.int32)
+    lengths = np.array(lengths, dtype=np.float64)
+    edge_water = np.array(edge_water, dtype=bool)
+    
+    # Edges grouped by source node (CSR layout); parallel edges stay separate entries
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(len(node_ids) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=len(node_ids)), out=indptr[1:])
+    
+    # The same edges grouped by target node, for searches that walk edges backwards
+    reverse_order = np.argsort(dst, kind='stable')
+    reverse_indptr = np.zeros(len(node_ids) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(dst, minlength=len(node_ids)), out=reverse_indptr[1:])
+    
+    # Adjacency of edges that don't cross water, as a CSR matrix over node indices
+    dry = ~edge_water
+    adjacency = sparse.csr_matrix(
+        (np.ones(dry.sum(), dtype=bool), (src[dry], dst[dry])),
+        shape=(len(node_ids), len(node_ids))
+    )
+    
+    G.graph['_node_ids'] = np.array(node_ids)
+    G.graph['_node_index'] = node_index
+    G.graph['_xy'] = xy
+    G.graph['_node_water'] = is_water
+    G.graph['_is_major'] = is_major
+    G.graph['_adjacency'] = adjacency
+    G.graph['_csr_indptr'] = indptr
+    G.graph['_csr_indices'] = dst[order]
+    G.graph['_csr_lengths'] = lengths[order]
+    G.graph['_csr_water'] = edge_water[order]
+    G.graph['_rcsr_indptr'] = reverse_indptr
+    G.graph['_rcsr_indices'] = src[reverse_order]
+    G.graph['_rcsr_lengths'] = lengths[reverse_order]
+    G.graph['_rcsr_water'] = edge_water[reverse_order]
+
+def _ensure_node_kdtree(G):
+    """Build a KD-tree over projected node coordinates for nearest-node lookups, cached on G.graph"""
+    if all(key in G.graph for key in NODE_KDTREE_KEYS):
+        return
+    
+    _ensure_node_arrays(G)
+    xy = G.graph['_xy']
+    
+    # Only nodes with coordinates can be snapped to
+    located = np.flatnonzero(~np.isnan(xy[:, 0]))
+    lat0 = float(np.mean(xy[located, 1])) if len(located) else 0.0
+    
+    G.graph['_kdtree'] = cKDTree(project_to_plane(xy[located, 1], xy[located, 0], lat0))
+    G.graph['_kdtree_nodes'] = located
+    G.graph['_kdtree_lat0'] = lat0
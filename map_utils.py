@@ -1,5 +1,13 @@
 import folium
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.plugins import FastMarkerCluster, PolyLineTextPath
+from folium.utilities import JsCode
 import math
+import numpy as np
+import shapely
+from data_processing import _ensure_node_arrays
+from _geo_numba import haversine_within_bulk
 import random
 
 def create_base_map(center_location):
@@ -33,12 +41,15 @@ def add_disaster_marker(m, disaster_node, radius):
     if not disaster_node:
         return
     
+    # Marker and circle share one layer, added to the map once
+    disaster_layer = folium.FeatureGroup(name='Disaster Zone')
+    
     # Add the disaster marker
     folium.Marker(
         location=disaster_node,
         icon=folium.Icon(color='red', icon='exclamation-circle', prefix='fa'),
         popup=f"Disaster Center<br>Radius: {radius}m"
-    ).add_to(m)
+    ).add_to(disaster_layer)
     
     # Add the impact radius circle
     folium.Circle(
@@ -49,7 +60,19 @@ def add_disaster_marker(m, disaster_node, radius):
         fill_color='red',
         fill_opacity=0.2,
         popup=f"Impact Radius: {radius}m"
-    ).add_to(m)
+    ).add_to(disaster_layer)
+    
+    disaster_layer.add_to(m)
+
+# Haversine "a" term at each radius: a point is within radius exactly when its a is at most this,
+# so radius checks can skip the asin/sqrt that turn a into a distance
+_a_thresh_cache = {}
+
+def _a_threshold(radius):
+    """Largest haversine a-value within radius meters (cached per radius)"""
+    if radius not in _a_thresh_cache:
+        _a_thresh_cache[radius] = math.sin(min(radius / 6371000, math.pi) / 2)**2
+    return _a_thresh_cache[radius]
 
 def check_if_in_radius(point, center, radius):
     """Check if a point is within the given radius from center"""
@@ -59,36 +82,137 @@ def check_if_in_radius(point, center, radius):
     # Convert latitude and longitude from degrees to radians
     lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
     
-    # Haversine formula
+    # Haversine formula, compared before converting to a distance
     dlon = lon2 - lon1
     dlat = lat2 - lat1
     a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371000  # Radius of earth in meters
+    return a <= _a_threshold(radius)
+
+def radius_bounding_box(center, radius):
+    """
+    Half-widths in degrees (dlat_deg, dlon_deg) of the smallest lat/lon box
+    containing every point within radius meters of center
+    """
+    angular_radius = radius / 6371000
+    dlat_deg = math.degrees(angular_radius)
     
-    distance = c * r
-    return distance <= radius
+    # The circle's widest longitude span; near the poles it can cover every longitude
+    sin_dlon = math.sin(angular_radius) / math.cos(math.radians(center[0]))
+    dlon_deg = math.degrees(math.asin(sin_dlon)) if angular_radius < math.pi / 2 and sin_dlon < 1 else 180.0
+    
+    return dlat_deg, dlon_deg
+
+def _lon_delta(lon1, lon2):
+    """Absolute longitude difference in degrees, taking the short way around the antimeridian (works on arrays)"""
+    delta = np.abs(lon1 - lon2) % 360
+    return np.minimum(delta, 360 - delta)
+
+def haversine_mask(lats, lons, center, radius):
+    """Vectorized check_if_in_radius: boolean mask of which (lats[i], lons[i]) lie within radius of center"""
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    
+    # Only points inside the circle's bounding box need the haversine test
+    dlat_deg, dlon_deg = radius_bounding_box(center, radius)
+    in_box = (np.abs(lats - center[0]) <= dlat_deg) & (_lon_delta(lons, center[1]) <= dlon_deg)
+    
+    mask = np.zeros(len(lats), dtype=bool)
+    lats, lons = np.radians(lats[in_box]), np.radians(lons[in_box])
+    clat, clon = np.radians(center[0]), np.radians(center[1])
+    
+    # Haversine formula, broadcast over all boxed points at once
+    dlon = clon - lons
+    dlat = clat - lats
+    a = np.sin(dlat/2)**2 + np.cos(lats) * np.cos(clat) * np.sin(dlon/2)**2
+    mask[in_box] = a <= _a_threshold(radius)
+    return mask
+
+# Builds a person marker from a [lat, lon, in_radius, person number] row:
+# red user icon in the danger zone, green check icon when safe. The two icons
+# and popup suffixes are created once and shared by every marker
+_PERSON_MARKER_CALLBACK = """
+    (function () {
+        var dangerIcon = L.AwesomeMarkers.icon({icon: 'user', markerColor: 'red', iconColor: 'white', prefix: 'fa'});
+        var safeIcon = L.AwesomeMarkers.icon({icon: 'check', markerColor: 'green', iconColor: 'white', prefix: 'fa'});
+        var dangerStatus = '<br>Status: In Danger Zone';
+        var safeStatus = '<br>Status: Safe';
+        
+        return function (row) {
+            var inRadius = row[2] === 1;
+            var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: inRadius ? dangerIcon : safeIcon});
+            marker.bindPopup('Person ' + row[3] + (inRadius ? dangerStatus : safeStatus));
+            return marker;
+        };
+    })()
+"""
+
+# Above this many people the radius check runs as a parallel compiled kernel
+_NUMBA_MASK_MIN_PEOPLE = 2000
 
 def add_person_markers(m, person_nodes, disaster_node, disaster_radius):
     """Add person markers to the map"""
     if not person_nodes:
         return
     
-    for i, (lat, lon) in enumerate(person_nodes):
-        in_radius = False
-        if disaster_node:
-            in_radius = check_if_in_radius((lat, lon), disaster_node, disaster_radius)
-        
-        # Choose icon and color based on whether person is in danger zone
-        icon_color = 'red' if in_radius else 'green'
-        icon_symbol = 'user' if in_radius else 'check'
-        popup_text = f"Person {i+1}<br>Status: {'In Danger Zone' if in_radius else 'Safe'}"
-        
-        folium.Marker(
-            location=[lat, lon],
-            icon=folium.Icon(color=icon_color, icon=icon_symbol, prefix='fa'),
-            popup=popup_text
-        ).add_to(m)
+    # Check every person against the disaster zone in one pass
+    in_radius_mask = np.zeros(len(person_nodes), dtype=bool)
+    if disaster_node:
+        lats = np.fromiter((lat for lat, _ in person_nodes), dtype=float, count=len(person_nodes))
+        lons = np.fromiter((lon for _, lon in person_nodes), dtype=float, count=len(person_nodes))
+        if len(person_nodes) > _NUMBA_MASK_MIN_PEOPLE:
+            in_radius_mask = haversine_within_bulk(
+                lats, lons, disaster_node[0], disaster_node[1],
+                _a_threshold(disaster_radius), np.empty(len(person_nodes), dtype=bool)
+            )
+        else:
+            in_radius_mask = haversine_mask(lats, lons, disaster_node, disaster_radius)
+    
+    # One row per person; markers are built in the browser by the callback below
+    # instead of serializing a folium.Marker per person
+    data = [
+        [lat, lon, in_radius, i + 1]
+        for i, ((lat, lon), in_radius) in enumerate(zip(person_nodes, in_radius_mask.astype(int).tolist()))
+    ]
+    
+    FastMarkerCluster(data, callback=_PERSON_MARKER_CALLBACK, name='People').add_to(m)
+
+# Arrows indicating direction, drawn as text glyphs repeated along each route line
+# by Leaflet.TextPath (the same decorator as PolyLineTextPath) in the route's color;
+# routes shorter than MIN_ARROW_ROUTE_LENGTH are left without arrows
+_ROUTE_ARROWS = JsCode("""
+    function (feature, layer) {
+        if (!feature.properties.arrows) {
+            return;
+        }
+        layer.setText('\\u27A4          ', {
+            repeat: true,
+            offset: 8,
+            attributes: {'fill': feature.properties.color, 'font-size': '18'}
+        });
+    }
+""")
+
+# Tolerance for simplifying route lines, in degrees (about 1 m)
+ROUTE_SIMPLIFY_TOLERANCE = 1e-5
+
+# Routes shorter than this (in meters) are too short for a visible direction arrow
+MIN_ARROW_ROUTE_LENGTH = 100
+
+def route_length(route_xy):
+    """Length in meters of a line given as an (N, 2) array of [lon, lat] points"""
+    lons, lats = np.radians(route_xy[:, 0]), np.radians(route_xy[:, 1])
+    
+    # Haversine formula over every consecutive pair of points
+    dlon = np.diff(lons)
+    dlat = np.diff(lats)
+    a = np.sin(dlat/2)**2 + np.cos(lats[:-1]) * np.cos(lats[1:]) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    r = 6371000  # Radius of earth in meters
+    
+    return float(np.sum(c * r))
+
+class _TextPathScript(JSCSSMixin, MacroElement):
+    """Loads Leaflet.TextPath, which adds setText() to the route polylines, after Leaflet itself"""
+    default_js = PolyLineTextPath.default_js
 
 def add_evacuation_paths(m, evacuation_routes, G):
     """Add evacuation paths to the map"""
@@ -96,63 +220,64 @@ def add_evacuation_paths(m, evacuation_routes, G):
         return
     
     # Generate a list of distinct colors for routes
-    colors = ['blue', 'purple', 'orange', 'darkred', 'darkblue', 'darkgreen', 'cadetblue', 
-              'darkpurple', 'pink', 'lightblue', 'lightgreen', 'gray', 'black']
+    colors = np.array(['blue', 'purple', 'orange', 'darkred', 'darkblue', 'darkgreen', 'cadetblue', 
+                       'darkpurple', 'pink', 'lightblue', 'lightgreen', 'gray', 'black'], dtype=object)
     
-    for i, ((person_lat, person_lon), route) in enumerate(evacuation_routes.items()):
+    # Color for every route up front, cycling through the colors list
+    route_colors = colors[np.arange(len(evacuation_routes)) % len(colors)]
+    
+    # Node coordinates as one (x, y) array, built once per road network
+    _ensure_node_arrays(G)
+    node_index = G.graph['_node_index']
+    xy = G.graph['_xy']
+    
+    # All routes go into one GeoJSON layer instead of a PolyLine each
+    features = []
+    
+    for i, (((person_lat, person_lon), route), route_color) in enumerate(zip(evacuation_routes.items(), route_colors)):
         if not route:
             continue
         
-        # Get path coordinates
-        path_coords = []
-        for node_id in route:
-            node_data = G.nodes[node_id]
-            if 'x' in node_data and 'y' in node_data:
-                path_coords.append([node_data['y'], node_data['x']])  # [lat, lon]
+        # Get path coordinates as [lon, lat], skipping nodes without a position (NaN)
+        route_xy = xy[[node_index[node_id] for node_id in route]]
+        route_xy = route_xy[~np.isnan(route_xy[:, 0])]
         
-        if not path_coords:
+        # A single point has no line to draw
+        if len(route_xy) < 2:
             continue
         
-        # Get a color for this route (cycle through the colors list)
-        color_idx = i % len(colors)
-        route_color = colors[color_idx]
+        # Drop nearly collinear intermediate nodes (Douglas-Peucker); the route's ends are kept
+        path_coords = shapely.get_coordinates(
+            shapely.LineString(route_xy).simplify(ROUTE_SIMPLIFY_TOLERANCE, preserve_topology=False)
+        ).tolist()
         
-        # Add the route path
-        folium.PolyLine(
-            locations=path_coords,
-            color=route_color,
-            weight=4,
-            opacity=0.8,
-            popup=f"Evacuation Route for Person {i+1}"
-        ).add_to(m)
-        
-        # Add arrow markers to indicate direction
-        if len(path_coords) >= 2:
-            # Add arrow at the midpoint
-            midpoint_idx = len(path_coords) // 2
-            add_arrow(m, path_coords[midpoint_idx-1], path_coords[midpoint_idx], route_color)
-            
-            # Add arrow near the end
-            if len(path_coords) >= 4:
-                end_idx = len(path_coords) - 2
-                add_arrow(m, path_coords[end_idx-1], path_coords[end_idx], route_color)
-
-def add_arrow(m, start_point, end_point, color):
-    """Add an arrow marker to indicate direction on a path"""
-    # Get the angle
-    x1, y1 = start_point[1], start_point[0]
-    x2, y2 = end_point[1], end_point[0]
-    
-    angle = math.degrees(math.atan2(y2 - y1, x2 - x1))
-    
-    # Create the arrow at the end point
-    folium.RegularPolygonMarker(
-        location=end_point,
-        number_of_sides=3,
-        radius=6,
-        rotation=angle,
-        color=color,
-        fill=True,
-        fill_color=color,
-        fill_opacity=0.8
+        # Add the route path (GeoJSON positions are [lon, lat])
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': path_coords
+            },
+            'properties': {
+                'color': route_color,
+                'route': f"Evacuation Route for Person {i+1}",
+                'arrows': route_length(route_xy) >= MIN_ARROW_ROUTE_LENGTH
+            }
+        })
+    
+    if not features:
+        return
+    
+    folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name='Evacuation Routes',
+        style_function=lambda feature: {
+            'color': feature['properties']['color'],
+            'weight': 4,
+            'opacity': 0.8
+        },
+        popup=folium.GeoJsonPopup(fields=['route'], labels=False),
+        on_each_feature=_ROUTE_ARROWS
     ).add_to(m)
+    
+    _TextPathScript().add_to(m)